@@ -2,31 +2,98 @@
 Script to load jobs data and create embeddings in Pinecone.
 Run this once to populate the vector database.
 """
-import json
+import asyncio
+import hashlib
+import itertools
 import os
+import random
+import re
+import sqlite3
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
+import ijson
+import numpy as np
+from openai import AsyncOpenAI
 from pinecone import Pinecone, ServerlessSpec
+from pinecone.exceptions import NotFoundException, PineconeApiException
 import time
 
 load_dotenv()
 
-# Initialize clients
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "resume-job-matching")
 JOBS_FILE = Path(__file__).parent.parent / "data" / "jobs.json"
+CACHE_FILE = Path(__file__).parent / ".embed_cache.sqlite"
+CACHE_DTYPE = np.float16  # Half precision halves the cache; cosine similarity barely changes
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_CHUNK = 256  # Texts per OpenAI embeddings request
+EMBED_CONCURRENCY = 8  # OpenAI embeddings requests in flight at once
+PINECONE_POOL_THREADS = 30  # Threads for concurrent Pinecone upserts
+MAX_RETRIES = 6
+
+# Initialize clients
+# The SDK retries rate-limited requests with jittered backoff, honouring Retry-After
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=MAX_RETRIES)
+pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), pool_threads=PINECONE_POOL_THREADS)
+
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
 
+# Filtering metadata: (metadata key, job field, type, default)
+_META_SPEC = (
+    # String fields
+    ("company_name", "company_name", str, ""),
+    ("location", "location", str, ""),
+    ("job_category", "job_category", str, ""),
+    ("employment_type", "employment_type", str, ""),
+    ("work_location_type", "work_location_type", str, ""),
+    ("status", "status", str, "active"),
+    # Array field
+    ("ideal_companies", "idealCompanies", list, ()),
+    # Boolean field
+    ("h1b_sponsorship", "h1b_sponsorship", bool, False),
+    # Number fields
+    ("yoe_min", "yoe_min", int, 0),
+    ("equity_min", "equity_min", float, 0.0),
+    ("equity_max", "equity_max", float, 0.0),
+)
+_META_KEYS = tuple(key for key, _, _, _ in _META_SPEC)
+_META_COERCERS = tuple((field, cast, default) for _, field, cast, default in _META_SPEC)
 
-def get_embedding(text: str, model: str = "text-embedding-3-small") -> list:
-    """Get embedding from OpenAI."""
-    response = openai_client.embeddings.create(
+
+async def get_embeddings_batch(texts: list[str], model: str = EMBED_MODEL) -> list:
+    """Get embeddings for several texts from OpenAI in a single request."""
+    response = await openai_client.embeddings.create(
         model=model,
-        input=text
+        input=texts
+    )
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+def open_cache() -> sqlite3.Connection:
+    """Open the local embedding cache, creating it if needed."""
+    cache = sqlite3.connect(CACHE_FILE)
+    cache.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB)")
+    return cache
+
+
+def cache_key(text: str, model: str = EMBED_MODEL) -> str:
+    """Cache key for an embedding: SHA-256 of the model, stored dtype and input text."""
+    return hashlib.sha256(f"{model}|{np.dtype(CACHE_DTYPE).name}|{text}".encode()).hexdigest()
+
+
+def cache_get(cache: sqlite3.Connection, key: str):
+    """Return the cached embedding for `key`, or None on a miss."""
+    row = cache.execute("SELECT vec FROM embeddings WHERE hash = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    return np.frombuffer(row[0], dtype=CACHE_DTYPE).tolist()
+
+
+def cache_put(cache: sqlite3.Connection, items: list[tuple[str, list]]):
+    """Store (key, embedding) pairs in the cache."""
+    cache.executemany(
+        "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)",
+        [(key, np.asarray(embedding, dtype=CACHE_DTYPE).tobytes()) for key, embedding in items]
     )
-    return response.data[0].embedding
 
 
 def create_job_text(job: dict) -> str:
@@ -40,17 +107,24 @@ def create_job_text(job: dict) -> str:
         job.get("location", ""),
     ]
     # Remove HTML tags from responsibilities if present
-    import re
     text = " ".join(parts)
-    text = re.sub(r'<[^>]+>', '', text)  # Remove HTML tags
+    text = _HTML_TAG_RE.sub('', text)  # Remove HTML tags
     return text.strip()
 
 
+_index = None
+
+
 def setup_pinecone_index():
-    """Create Pinecone index if it doesn't exist."""
-    existing_indexes = [idx.name for idx in pc.list_indexes()]
+    """Create Pinecone index if it doesn't exist, and return a shared handle to it."""
+    global _index
+    if _index is not None:
+        return _index
     
-    if INDEX_NAME not in existing_indexes:
+    try:
+        pc.describe_index(INDEX_NAME)
+        print(f"Index {INDEX_NAME} already exists")
+    except NotFoundException:
         print(f"Creating index: {INDEX_NAME}")
         # Get region from env (format: us-east-1, us-west-2, etc.)
         region = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
@@ -67,20 +141,53 @@ def setup_pinecone_index():
         )
         print(f"Index {INDEX_NAME} created. Waiting for it to be ready...")
         time.sleep(5)
-    else:
-        print(f"Index {INDEX_NAME} already exists")
     
-    return pc.Index(INDEX_NAME)
+    _index = pc.Index(INDEX_NAME)
+    return _index
 
 
-def embed_jobs():
-    """Load jobs and create embeddings in Pinecone."""
-    print("Loading jobs data...")
-    with open(JOBS_FILE, "r") as f:
-        jobs = json.load(f)
-    
-    print(f"Found {len(jobs)} jobs")
-    
+def wait_for_upsert(index, vectors: list[dict], upsert):
+    """Wait for an async upsert, re-sending it with backoff while Pinecone rate-limits it."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return upsert.get()
+        except PineconeApiException as e:
+            if e.status != 429 or attempt == MAX_RETRIES - 1:
+                raise
+        time.sleep(min(0.1 * 2 ** attempt, 5) + random.uniform(0, 0.1))
+        upsert = index.upsert(vectors=vectors, async_req=True)
+
+
+def build_metadata(job: dict) -> dict:
+    """Coerce a job's filtering fields to their metadata types, defaulting missing or null ones."""
+    get = job.get
+    return dict(zip(_META_KEYS, [cast(get(field) or default) for field, cast, default in _META_COERCERS]))
+
+
+def build_vector(job: dict, embedding: list) -> dict:
+    """Build the Pinecone vector for a job, with all filtering fields as metadata."""
+    return {
+        "id": job["job_id"],
+        "values": embedding,
+        "metadata": build_metadata(job)
+    }
+
+
+def iter_jobs():
+    """Stream jobs from the jobs file one at a time."""
+    with open(JOBS_FILE, "rb") as f:
+        yield from ijson.items(f, "item", use_float=True)
+
+
+def iter_windows(jobs, size: int):
+    """Group an iterable of jobs into lists of at most `size` jobs."""
+    jobs = iter(jobs)
+    while window := list(itertools.islice(jobs, size)):
+        yield window
+
+
+async def embed_jobs():
+    """Stream jobs and create embeddings in Pinecone."""
     # Setup Pinecone index
     index = setup_pinecone_index()
     
@@ -98,60 +205,61 @@ def embed_jobs():
             return
     
     print("Creating embeddings and uploading to Pinecone...")
-    batch_size = 100
-    vectors = []
+    batch_size = 100  # Vectors per Pinecone upsert, independent of EMBED_CHUNK
+    sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+    cache = open_cache()
+    total = 0
+    cached = 0
     
-    for i, job in enumerate(jobs):
-        # Create text representation
-        job_text = create_job_text(job)
-        
-        # Get embedding
-        embedding = get_embedding(job_text)
-        
-        # Prepare metadata with all filtering fields
-        metadata = {
-            # String fields
-            "company_name": job.get("company_name", ""),
-            "location": job.get("location", ""),
-            "job_category": job.get("job_category", ""),
-            "employment_type": job.get("employment_type", ""),
-            "work_location_type": job.get("work_location_type", ""),
-            "status": job.get("status", "active"),
+    def upsert_async(vectors: list[dict], upserts: list):
+        # Hand upserts to the Pinecone thread pool so they overlap with later embedding requests
+        for start in range(0, len(vectors), batch_size):
+            batch = vectors[start:start + batch_size]
+            upserts.append((batch, index.upsert(vectors=batch, async_req=True)))
+    
+    async def embed_chunk(chunk: list[tuple[dict, str, str]], upserts: list):
+        async with sem:
+            embeddings = await get_embeddings_batch([text for _, text, _ in chunk])
+        # Round to cache precision so a job upserts the same vector whether or not it was cached
+        embeddings = np.asarray(embeddings, dtype=CACHE_DTYPE)
+        # Commit per chunk so embeddings already paid for survive a later failure
+        with cache:
+            cache_put(cache, [(key, embedding) for (_, _, key), embedding in zip(chunk, embeddings)])
+        upsert_async([build_vector(job, embedding.tolist()) for (job, _, _), embedding in zip(chunk, embeddings)], upserts)
+    
+    try:
+        # Only one window of jobs is held in memory at a time
+        for jobs in iter_windows(iter_jobs(), EMBED_CHUNK * EMBED_CONCURRENCY):
+            upserts = []
+            hits = []
+            misses = []
+            for job in jobs:
+                text = create_job_text(job)
+                key = cache_key(text)
+                embedding = cache_get(cache, key)
+                if embedding is None:
+                    misses.append((job, text, key))
+                else:
+                    hits.append(build_vector(job, embedding))
+            upsert_async(hits, upserts)
             
-            # Array field
-            "ideal_companies": job.get("idealCompanies", []),
+            # Sort by text length so each embedding request holds similarly sized inputs
+            misses.sort(key=lambda t: len(t[1]))
+            chunks = [misses[start:start + EMBED_CHUNK] for start in range(0, len(misses), EMBED_CHUNK)]
             
-            # Boolean field
-            "h1b_sponsorship": bool(job.get("h1b_sponsorship", False)),
+            await asyncio.gather(*[embed_chunk(chunk, upserts) for chunk in chunks])
+            for batch, upsert in upserts:
+                wait_for_upsert(index, batch, upsert)
             
-            # Number fields
-            "yoe_min": int(job.get("yoe_min", 0)),
-            "equity_min": float(job.get("equity_min", 0.0)),
-            "equity_max": float(job.get("equity_max", 0.0)),
-        }
-        
-        # Prepare vector
-        vectors.append({
-            "id": job["job_id"],
-            "values": embedding,
-            "metadata": metadata
-        })
-        
-        # Upload in batches
-        if len(vectors) >= batch_size:
-            index.upsert(vectors=vectors)
-            print(f"Uploaded batch: {i+1}/{len(jobs)} jobs")
-            vectors = []
-            time.sleep(0.5)  # Rate limiting
-    
-    # Upload remaining vectors
-    if vectors:
-        index.upsert(vectors=vectors)
-        print(f"Uploaded final batch: {len(jobs)}/{len(jobs)} jobs")
+            total += len(jobs)
+            cached += len(hits)
+            print(f"Uploaded {total} jobs ({cached} from cache)")
+    finally:
+        cache.close()
     
-    print(f"\n✅ Successfully embedded {len(jobs)} jobs into Pinecone index: {INDEX_NAME}")
+    print(f"\n✅ Successfully embedded {total} jobs into Pinecone index: {INDEX_NAME}")
 
 
 if __name__ == "__main__":
-    embed_jobs()
+    asyncio.run(embed_jobs())
 
@@ -1,5 +1,15 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from candidate_service.config import ALLOWED_ORIGINS, MAX_FILE_SIZE
 from candidate_service.matching_service import run_match
@@ -10,8 +20,40 @@ from candidate_service.embeddings import get_embedding
 
 import time
 
+READ_CHUNK_SIZE = 64 * 1024  # Bytes per upload read
+EMBEDDING_CACHE_SIZE = 1024  # Resume embeddings kept in memory
+MAX_BATCH_FILES = 20  # Resumes per /embed-resumes request
+ALLOWED_UPLOADS = {("application/pdf", "pdf"), ("text/plain", "txt")}  # (content type, extension)
+ALLOWED_EXTENSIONS = {ext for _, ext in ALLOWED_UPLOADS}
+GENERIC_CONTENT_TYPES = {"", "application/octet-stream"}  # Sent when the client doesn't know the type
+
+
+def new_pdf_executor() -> ProcessPoolExecutor:
+    # Spawn rather than fork: workers start after the event loop and its threads are running
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+
+# PDF parsing is CPU-bound and holds the GIL, so it gets its own worker processes;
+# created in the app lifespan so each startup is paired with its shutdown
+pdf_executor = None
+
+# LRU of resume embeddings keyed by SHA-256 of the text; only touched on the event loop
+embedding_cache: OrderedDict[str, list] = OrderedDict()
+
 
-app = FastAPI(title="Resume Matching Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pdf_executor
+    pdf_executor = new_pdf_executor()
+    yield
+    pdf_executor.shutdown()
+
+
+app = FastAPI(
+    title="Resume Matching Service",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # Faster encoding for resume text and match results
+)
 
 # CORS middleware
 app.add_middleware(
@@ -28,44 +70,93 @@ def root():
     return {"status": "ok", "message": "Resume Matching Service - Ready for PDF upload"}
 
 
-@app.post("/embed-resume")
-async def embed_resume(file: UploadFile = File(...)):
-    """
-    Upload a PDF or TXT resume, extract text, and create embedding.
-    Returns the embedding and extracted text.
-    
-    Limits:
-    - Max file size: 10MB
-    - Max pages processed: 10 pages (PDF only)
-    - Max text length: 50,000 characters
-    """
+async def embed_resume_text(resume_text: str) -> list:
+    """Embed resume text, reusing the cached embedding for a repeated upload."""
+    key = hashlib.sha256(resume_text.encode()).hexdigest()
+    embedding = embedding_cache.get(key)
+    if embedding is not None:
+        embedding_cache.move_to_end(key)
+        return embedding
+
+    loop = asyncio.get_running_loop()
+    embedding = await loop.run_in_executor(None, get_embedding, resume_text)
+    embedding_cache[key] = embedding
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+    return embedding
+
+
+async def parse_pdf(file_bytes: bytes) -> str:
+    """Extract PDF text in the worker pool, replacing the pool if a worker died."""
+    global pdf_executor
+    executor = pdf_executor
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, extract_text_from_pdf, file_bytes)
+    except BrokenProcessPool:
+        # Only the first request to see the broken pool replaces it
+        if pdf_executor is executor:
+            pdf_executor = new_pdf_executor()
+            executor.shutdown(wait=False)
+        raise HTTPException(
+            status_code=500,
+            detail="PDF parser crashed while reading this file. Please try again or use a smaller file.",
+        )
+
+
+async def process_resume(file: UploadFile, include_text: bool) -> dict:
+    """Validate, parse and embed one uploaded resume."""
     # Validate file type
     if not file.filename:
         raise HTTPException(status_code=400, detail="Filename is required")
     
-    file_ext = file.filename.lower().split('.')[-1] if '.' in file.filename else ''
-    if file_ext not in ['pdf', 'txt']:
+    file_ext = file.filename.rpartition('.')[2].lower() if '.' in file.filename else ''
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Only PDF and TXT files are supported")
+
+    # Reject a declared MIME type that contradicts the extension; clients that send
+    # no specific type are accepted, and PDF content is checked after the read
+    content_type = (file.content_type or '').partition(';')[0].strip().lower()
+    if content_type not in GENERIC_CONTENT_TYPES and (content_type, file_ext) not in ALLOWED_UPLOADS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Content type '{content_type}' does not match a .{file_ext} file",
+        )
     
     try:
         start_time = time.time()
 
-        file_bytes = await file.read()
-        file_size = len(file_bytes)
-
-        if file_size > MAX_FILE_SIZE:
-            size_mb = file_size / (1024 * 1024)
-            max_mb = MAX_FILE_SIZE / (1024 * 1024)
+        # The multipart parser has already spooled the upload, so check its size before reading
+        max_mb = MAX_FILE_SIZE / (1024 * 1024)
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            size_mb = file.size / (1024 * 1024)
             raise HTTPException(
                 status_code=400,
                 detail=f"File too large ({size_mb:.1f}MB). Maximum file size is {max_mb}MB.",
             )
 
+        # Backstop for uploads without a known size: stop reading once past the limit
+        file_bytes = bytearray()
+        while chunk := await file.read(READ_CHUNK_SIZE):
+            file_bytes.extend(chunk)
+            if len(file_bytes) > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large. Maximum file size is {max_mb}MB.",
+                )
+
+        file_size = len(file_bytes)
+
         if file_size == 0:
             raise HTTPException(status_code=400, detail="File is empty")
 
+        # Parsing and embedding are blocking; run them off the event loop
+        loop = asyncio.get_running_loop()
+
         if file_ext == "pdf":
-            resume_text = extract_text_from_pdf(file_bytes)
+            # Readers accept the header anywhere in the first 1024 bytes (BOM, whitespace, etc.)
+            if b"%PDF-" not in file_bytes[:1024]:
+                raise HTTPException(status_code=400, detail="File is not a valid PDF")
+            resume_text = await parse_pdf(bytes(file_bytes))
         else:
             try:
                 resume_text = file_bytes.decode("utf-8")
@@ -81,22 +172,24 @@ async def embed_resume(file: UploadFile = File(...)):
                 ),
             )
 
-        resume_metadata = extract_resume_metadata(resume_text)
-        embedding = get_embedding(resume_text)
+        resume_metadata = await loop.run_in_executor(None, extract_resume_metadata, resume_text)
+        embedding = await embed_resume_text(resume_text)
 
         processing_time = int((time.time() - start_time) * 1000)
 
-        return {
+        result = {
             "status": "success",
             "filename": file.filename,
             "file_size_bytes": file_size,
             "text_length": len(resume_text),
             "embedding_dimension": len(embedding),
             "processing_time_ms": processing_time,
-            "resume_text": resume_text,
             "resume_metadata": resume_metadata,
             "message": "Resume successfully embedded. Ready for matching.",
         }
+        if include_text:
+            result["resume_text"] = resume_text
+        return result
 
     except HTTPException:
         raise
@@ -110,6 +203,55 @@ async def embed_resume(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {error_msg}")
 
 
+@app.post("/embed-resume")
+async def embed_resume(file: UploadFile = File(...), include_text: bool = False):
+    """
+    Upload a PDF or TXT resume, extract text, and create embedding.
+    Returns the embedding summary and resume metadata; pass
+    `include_text=true` to also get the extracted text back.
+    
+    Limits:
+    - Max file size: 10MB
+    - Max pages processed: 10 pages (PDF only)
+    - Max text length: 50,000 characters
+    """
+    return await process_resume(file, include_text)
+
+
+@app.post("/embed-resumes")
+async def embed_resumes(files: list[UploadFile] = File(...), include_text: bool = False):
+    """
+    Upload several PDF or TXT resumes in one request.
+    Files are parsed and embedded concurrently; results are returned
+    in upload order, each in the same shape as /embed-resume.
+    
+    Limits:
+    - Max files per request: 20
+    - Same per-file limits as /embed-resume
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum is {MAX_BATCH_FILES} per request.",
+        )
+
+    async def process_named(file: UploadFile) -> dict:
+        try:
+            return await process_resume(file, include_text)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"{file.filename}: {e.detail}") from e
+
+    tasks = [asyncio.create_task(process_named(file)) for file in files]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the other files' parsing and embedding once the request has failed
+        for task in tasks:
+            task.cancel()
+        raise
+    return {"status": "success", "count": len(results), "results": results}
+
+
 @app.post("/match")
 async def match_resume(request: MatchRequest):
     return await run_match(request)
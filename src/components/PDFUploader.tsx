@@ -66,7 +66,7 @@ export default function PDFUploader({ onMatchesFound, onNewUpload }: PDFUploader
       const formData = new FormData();
       formData.append('file', file);
 
-      const response = await fetch('http://localhost:8000/embed-resume', {
+      const response = await fetch('http://localhost:8000/embed-resume?include_text=true', {
         method: 'POST',
         body: formData,
       });